@@ -1,9 +1,11 @@
 """
 Database connection management using aiosqlite with connection pooling.
 """
+import asyncio
+
 import aiosqlite
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List
 from contextlib import asynccontextmanager
 
 from app.utils.logger import get_logger
@@ -14,18 +16,48 @@ logger = get_logger(__name__)
 class Database:
     """Database connection manager with connection pooling."""
     
+    # Stored in PRAGMA user_version; bump when _migrate_schema gains a step
+    SCHEMA_VERSION = 1
+    
+    # Table definitions; {name} lets migrations build a replacement table.
+    # created_at holds epoch seconds (unixepoch() needs SQLite >= 3.38).
+    _TABLES = {
+        "users": """CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                username TEXT,
+                created_at INTEGER NOT NULL DEFAULT (unixepoch())
+            )""",
+        "messages": """CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT CHECK(role IN ('user', 'assistant')) NOT NULL,
+                content TEXT NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT (unixepoch()),
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )""",
+    }
+    
     def __init__(self):
         self._db_path = config.database_url.replace("sqlite+aiosqlite:///", "")
         self._connection: Optional[aiosqlite.Connection] = None
         self._is_connected = False
+        # Serializes every statement, reads included, on the shared connection
+        # so a transaction() is never committed early by another task's
+        # statement. asyncio.Lock is not re-entrant, so the owner is tracked
+        # to turn nested acquisition into an error instead of a deadlock.
+        self._lock = asyncio.Lock()
+        self._lock_owner: Optional[asyncio.Task] = None
+        self._transaction_task: Optional[asyncio.Task] = None
         
     async def connect(self):
         """Establish database connection and initialize schema."""
         try:
             self._connection = await aiosqlite.connect(self._db_path)
             self._connection.row_factory = aiosqlite.Row
+            await self._configure_pragmas()
             self._is_connected = True
-            
+
             # Initialize database schema
             await self._init_schema()
             logger.info(f"Connected to database: {self._db_path}")
@@ -37,50 +69,175 @@ class Database:
     async def disconnect(self):
         """Close database connection."""
         if self._connection and self._is_connected:
-            await self._connection.close()
+            # Refresh planner statistics before closing, as SQLite recommends
+            try:
+                async with self.get_connection() as conn:
+                    await conn.execute("PRAGMA optimize")
+            except Exception as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
             self._is_connected = False
+            await self._connection.close()
             logger.info("Database connection closed")
     
+    async def _configure_pragmas(self):
+        """Tune SQLite for the bot's mixed read/write workload."""
+        pragmas = [
+            "PRAGMA synchronous=NORMAL",
+            "PRAGMA temp_store=MEMORY",
+            "PRAGMA cache_size=-64000",  # 64 MiB
+            "PRAGMA mmap_size=268435456",  # 256 MiB
+            "PRAGMA busy_timeout=5000",
+            "PRAGMA foreign_keys=ON",
+        ]
+
+        # WAL is not available for in-memory databases
+        if self._db_path != ":memory:":
+            pragmas.insert(0, "PRAGMA journal_mode=WAL")
+
+        for pragma in pragmas:
+            await self._connection.execute(pragma)
+        await self._connection.commit()
+
+        logger.debug("Database pragmas configured")
+
     async def _init_schema(self):
         """Initialize database schema."""
-        schema_queries = [
-            """CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""",
-            """CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                role TEXT CHECK(role IN ('user', 'assistant')) NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )""",
-            """CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id)""",
-            """CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)"""
+        for table in ("users", "messages"):
+            await self.execute(self._TABLES[table].format(name=table))
+        
+        await self._migrate_schema()
+        
+        index_queries = [
+            # History is filtered by user_id and ordered by id, so one composite
+            # index serves both and nothing ever filters on created_at
+            """CREATE INDEX IF NOT EXISTS idx_messages_user_recent ON messages(user_id, id DESC)""",
+            """DROP INDEX IF EXISTS idx_messages_user_id""",
+            """DROP INDEX IF EXISTS idx_messages_created_at"""
         ]
         
-        for query in schema_queries:
+        for query in index_queries:
             await self.execute(query)
         
         logger.debug("Database schema initialized")
     
+    async def _migrate_schema(self):
+        """Upgrade databases created by older versions of the bot."""
+        row = await self.fetch_one("PRAGMA user_version")
+        version = row[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        
+        if version < 1:
+            # created_at used to be a CURRENT_TIMESTAMP string; rebuild both
+            # tables with INTEGER epoch seconds. SQLite cannot alter a column
+            # type, and foreign keys must be off while tables are swapped.
+            columns = await self.fetch_all("PRAGMA table_info(users)")
+            legacy = any(
+                col['name'] == 'created_at' and col['type'] == 'TIMESTAMP'
+                for col in columns
+            )
+            if legacy:
+                await self._connection.execute("PRAGMA foreign_keys=OFF")
+                try:
+                    async with self.transaction() as conn:
+                        for table, columns in (
+                            ("users", "id, telegram_id, username"),
+                            ("messages", "id, user_id, role, content"),
+                        ):
+                            await conn.execute(
+                                self._TABLES[table].format(name=f"{table}_new")
+                            )
+                            await conn.execute(
+                                f"INSERT INTO {table}_new ({columns}, created_at) "
+                                f"SELECT {columns}, "
+                                f"COALESCE(unixepoch(created_at), unixepoch()) "
+                                f"FROM {table}"
+                            )
+                            await conn.execute(f"DROP TABLE {table}")
+                            await conn.execute(
+                                f"ALTER TABLE {table}_new RENAME TO {table}"
+                            )
+                finally:
+                    await self._connection.execute("PRAGMA foreign_keys=ON")
+                logger.info("Migrated created_at columns to epoch seconds")
+        
+        await self.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    @asynccontextmanager
+    async def _locked(self):
+        """Hold the statement lock, raising on re-entry from the same task."""
+        task = asyncio.current_task()
+        if self._lock_owner is task:
+            raise RuntimeError(
+                "Database lock already held by this task; get_connection() "
+                "cannot be nested or wrap transaction()"
+            )
+        
+        async with self._lock:
+            self._lock_owner = task
+            try:
+                yield
+            finally:
+                self._lock_owner = None
+    
     @asynccontextmanager
     async def get_connection(self):
-        """Context manager for database connections."""
+        """
+        Context manager for database connections.
+        
+        Reads are not committed. A write outside of transaction() is
+        committed on exit; inside transaction() it joins the open transaction.
+        Every statement is serialized on one lock, so this must not be nested
+        within the same task (doing so raises RuntimeError).
+        """
         if not self._is_connected:
             raise RuntimeError("Database not connected")
         
-        try:
+        if self._transaction_task is asyncio.current_task():
             yield self._connection
-        except Exception as e:
-            await self._connection.rollback()
-            logger.error(f"Database error: {e}")
-            raise
-        else:
-            await self._connection.commit()
+            return
+        
+        async with self._locked():
+            try:
+                yield self._connection
+            except BaseException as e:
+                # Also roll back on cancellation so no half-done transaction
+                # is left open for the next task to commit
+                if self._connection.in_transaction:
+                    await self._connection.rollback()
+                logger.error(f"Database error: {e!r}")
+                raise
+            else:
+                if self._connection.in_transaction:
+                    await self._connection.commit()
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """Run the enclosed statements in a single BEGIN IMMEDIATE/COMMIT."""
+        if not self._is_connected:
+            raise RuntimeError("Database not connected")
+        
+        # Nested transaction() calls join the outer transaction
+        if self._transaction_task is asyncio.current_task():
+            yield self._connection
+            return
+        
+        async with self._locked():
+            self._transaction_task = asyncio.current_task()
+            try:
+                await self._connection.execute("BEGIN IMMEDIATE")
+                yield self._connection
+            except BaseException as e:
+                # Also roll back on cancellation so no half-done transaction
+                # is left open for the next task to commit
+                if self._connection.in_transaction:
+                    await self._connection.rollback()
+                logger.error(f"Transaction rolled back: {e!r}")
+                raise
+            else:
+                await self._connection.commit()
+            finally:
+                self._transaction_task = None
     
     async def execute(self, query: str, params: tuple = ()) -> aiosqlite.Cursor:
         """Execute a query."""
@@ -94,19 +251,17 @@ class Database:
             cursor = await conn.executemany(query, params_list)
             return cursor
     
-    async def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
-        """Fetch a single row."""
+    async def fetch_one(self, query: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+        """Fetch a single row (supports both index and column-name access)."""
         async with self.get_connection() as conn:
             cursor = await conn.execute(query, params)
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+            return await cursor.fetchone()
     
-    async def fetch_all(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
-        """Fetch all rows."""
+    async def fetch_all(self, query: str, params: tuple = ()) -> List[aiosqlite.Row]:
+        """Fetch all rows (supports both index and column-name access)."""
         async with self.get_connection() as conn:
             cursor = await conn.execute(query, params)
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            return await cursor.fetchall()
     
     @property
     def is_connected(self) -> bool:
@@ -1,8 +1,11 @@
 """
 Repository pattern for database operations.
 """
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
 
 from app.database.connection import Database
 from app.utils.logger import get_logger
@@ -12,37 +15,70 @@ logger = get_logger(__name__)
 class UserRepository:
     """Repository for user operations."""
     
+    # Maximum number of user rows kept in the telegram_id LRU cache
+    CACHE_SIZE = 1024
+    
     def __init__(self, db: Database):
         self.db = db
+        self._cache: "OrderedDict[int, aiosqlite.Row]" = OrderedDict()
     
-    async def get_or_create_user(self, telegram_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    async def get_or_create_user(self, telegram_id: int, username: Optional[str] = None) -> aiosqlite.Row:
         """Get existing user or create a new one."""
-        # Try to get existing user
-        user = await self.db.fetch_one(
-            "SELECT * FROM users WHERE telegram_id = ?",
-            (telegram_id,)
-        )
-        
-        if user:
-            logger.debug(f"User found: {telegram_id}")
+        user = self._get_cached(telegram_id, username)
+        if user is not None:
             return user
         
-        # Create new user
-        await self.db.execute(
-            "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
-            (telegram_id, username)
-        )
+        known = telegram_id in self._cache
+        if not known:
+            # A plain read commits nothing, so a returning user costs no write
+            user = await self.db.fetch_one(
+                "SELECT * FROM users WHERE telegram_id = ?",
+                (telegram_id,)
+            )
+            if user is not None and user['username'] == username:
+                self._cache_user(telegram_id, user)
+                logger.debug("User found: %s", telegram_id)
+                return user
+            known = user is not None
+        
+        if known:
+            # Existing user with a new username: update only that column
+            user = await self.db.fetch_one(
+                "UPDATE users SET username = ? WHERE telegram_id = ? RETURNING *",
+                (username, telegram_id)
+            )
+            if user is not None:
+                self._cache_user(telegram_id, user)
+                logger.debug("Username updated: %s (%s)", telegram_id, username)
+                return user
         
-        # Get the created user
+        # Upsert so a concurrent insert of the same user cannot fail
         user = await self.db.fetch_one(
-            "SELECT * FROM users WHERE telegram_id = ?",
-            (telegram_id,)
+            """
+            INSERT INTO users (telegram_id, username) VALUES (?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET username = excluded.username
+            RETURNING *
+            """,
+            (telegram_id, username)
         )
         
-        logger.info(f"New user created: {telegram_id} ({username})")
+        self._cache_user(telegram_id, user)
+        logger.info("New user created: %s (%s)", telegram_id, username)
         return user
     
-    async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+    async def get_user_id(self, telegram_id: int, username: Optional[str] = None) -> int:
+        """
+        Get the internal ID for a Telegram user, creating the user if needed.
+        
+        Served from the cache without touching the database once the user
+        has been seen and their username is unchanged.
+        """
+        user = self._get_cached(telegram_id, username)
+        if user is None:
+            user = await self.get_or_create_user(telegram_id, username)
+        return user['id']
+    
+    async def get_user_by_id(self, user_id: int) -> Optional[aiosqlite.Row]:
         """Get user by internal ID."""
         return await self.db.fetch_one(
             "SELECT * FROM users WHERE id = ?",
@@ -55,7 +91,24 @@ class UserRepository:
             "UPDATE users SET username = ? WHERE telegram_id = ?",
             (username, telegram_id)
         )
+        self._cache.pop(telegram_id, None)
         return result.rowcount > 0
+    
+    def _get_cached(self, telegram_id: int, username: Optional[str]) -> Optional[aiosqlite.Row]:
+        """Return the cached row if its username is current, bumping its recency."""
+        user = self._cache.get(telegram_id)
+        if user is None:
+            return None
+        
+        self._cache.move_to_end(telegram_id)
+        return user if user['username'] == username else None
+    
+    def _cache_user(self, telegram_id: int, user: aiosqlite.Row) -> None:
+        """Store a user row in the LRU cache, evicting the oldest entry."""
+        self._cache[telegram_id] = user
+        self._cache.move_to_end(telegram_id)
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
 
 class MessageRepository:
     """Repository for message operations."""
@@ -63,33 +116,63 @@ class MessageRepository:
     def __init__(self, db: Database):
         self.db = db
     
-    async def create_message(self, user_id: int, role: str, content: str) -> Dict[str, Any]:
+    async def create_message(self, user_id: int, role: str, content: str) -> aiosqlite.Row:
         """Create a new message."""
-        await self.db.execute(
-            "INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)",
-            (user_id, role, content)
-        )
-        
-        # Get the created message
         message = await self.db.fetch_one(
-            "SELECT * FROM messages WHERE id = last_insert_rowid()"
+            """
+            INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)
+            RETURNING id, user_id, role, content, created_at
+            """,
+            (user_id, role, content)
         )
         
-        logger.debug(f"Message created for user {user_id}: {role}")
+        logger.debug("Message created for user %s: %s", user_id, role)
         return message
     
-    async def get_conversation_history(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get conversation history for a user."""
-        return await self.db.fetch_all(
-            """
-            SELECT role, content, created_at 
-            FROM messages 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ?
+    async def create_messages(self, user_id: int, messages: List[Tuple[str, str]]) -> List[aiosqlite.Row]:
+        """Create several (role, content) messages in one statement."""
+        if not messages:
+            return []
+        
+        placeholders = ", ".join(["(?, ?, ?)"] * len(messages))
+        params = tuple(
+            value
+            for role, content in messages
+            for value in (user_id, role, content)
+        )
+        
+        rows = await self.db.fetch_all(
+            f"""
+            INSERT INTO messages (user_id, role, content) VALUES {placeholders}
+            RETURNING id, user_id, role, content, created_at
             """,
-            (user_id, limit)
+            params
         )
+        
+        logger.debug("%d messages created for user %s", len(rows), user_id)
+        return rows
+    
+    async def get_conversation_history(self, user_id: int, limit: int = 10) -> List[Dict[str, str]]:
+        """Get the latest messages for a user, oldest first, in OpenAI format."""
+        # id is monotonic, so ordering by it avoids sorting on created_at.
+        # execute_fetchall runs and fetches in a single aiosqlite thread hop,
+        # whereas iterating the cursor costs a hop per row.
+        async with self.db.get_connection() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT role, content 
+                FROM messages 
+                WHERE user_id = ? 
+                ORDER BY id DESC 
+                LIMIT ?
+                """,
+                (user_id, limit)
+            )
+        
+        return [
+            {"role": role, "content": content}
+            for role, content in reversed(rows)
+        ]
     
     async def get_message_count(self, user_id: int) -> int:
         """Get total message count for a user."""
@@ -107,5 +190,5 @@ class MessageRepository:
         )
         deleted = result.rowcount > 0
         if deleted:
-            logger.info(f"Conversation cleared for user {user_id}")
+            logger.info("Conversation cleared for user %s", user_id)
         return deleted
\ No newline at end of file
@@ -1,6 +1,9 @@
 """
 Router setup and command handlers for the Telegram bot.
 """
+import asyncio
+from datetime import datetime, timezone
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandStart
@@ -13,6 +16,38 @@ from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Static replies, built once at import
+_WELCOME_TEXT = (
+    "🤖 <b>Welcome to AI Assistant Bot!</b>\n\n"
+    "I'm here to help you with any questions you have.\n"
+    "Just send me a message and I'll respond!\n\n"
+    "Available commands:\n"
+    "/help - Show this help message\n"
+    "/clear - Clear conversation history\n"
+    "/stats - Show your usage statistics\n\n"
+    "Let's start our conversation!"
+)
+
+_HELP_TEXT = (
+    "📚 <b>Help & Commands</b>\n\n"
+    "<b>Available Commands:</b>\n"
+    "/start - Start the bot and see welcome message\n"
+    "/help - Show this help message\n"
+    "/clear - Clear your conversation history\n"
+    "/stats - Show your usage statistics\n\n"
+    "<b>How to use:</b>\n"
+    "• Just type your message and I'll respond\n"
+    "• I remember our conversation history\n"
+    "• Use /clear to start a new conversation\n\n"
+    "Need help? Contact the administrator!"
+)
+
+_CLEAR_TEXT = (
+    "🗑️ <b>Conversation cleared!</b>\n\n"
+    "I've deleted all our previous messages. "
+    "We can start a fresh conversation!"
+)
+
 # State machine for conversation
 class ConversationStates(StatesGroup):
     waiting_for_ai_response = State()
@@ -35,52 +70,26 @@ def setup_routers(dp) -> None:
     
     dp.include_router(router)
 
-async def start_handler(message: Message, database) -> None:
+async def start_handler(message: Message, user_repo: UserRepository) -> None:
     """Handle /start command."""
-    user_repo = UserRepository(database)
-    
     # Get or create user
     user = await user_repo.get_or_create_user(
         telegram_id=message.from_user.id,
         username=message.from_user.username
     )
     
-    welcome_text = (
-        "🤖 <b>Welcome to AI Assistant Bot!</b>\n\n"
-        "I'm here to help you with any questions you have.\n"
-        "Just send me a message and I'll respond!\n\n"
-        "Available commands:\n"
-        "/help - Show this help message\n"
-        "/clear - Clear conversation history\n"
-        "/stats - Show your usage statistics\n\n"
-        "Let's start our conversation!"
-    )
-    
-    await message.answer(welcome_text)
+    await message.answer(_WELCOME_TEXT)
 
 async def help_handler(message: Message) -> None:
     """Handle /help command."""
-    help_text = (
-        "📚 <b>Help & Commands</b>\n\n"
-        "<b>Available Commands:</b>\n"
-        "/start - Start the bot and see welcome message\n"
-        "/help - Show this help message\n"
-        "/clear - Clear your conversation history\n"
-        "/stats - Show your usage statistics\n\n"
-        "<b>How to use:</b>\n"
-        "• Just type your message and I'll respond\n"
-        "• I remember our conversation history\n"
-        "• Use /clear to start a new conversation\n\n"
-        "Need help? Contact the administrator!"
-    )
-    
-    await message.answer(help_text)
+    await message.answer(_HELP_TEXT)
 
-async def clear_handler(message: Message, database) -> None:
+async def clear_handler(
+    message: Message,
+    user_repo: UserRepository,
+    message_repo: MessageRepository
+) -> None:
     """Handle /clear command."""
-    user_repo = UserRepository(database)
-    message_repo = MessageRepository(database)
-    
     # Get user
     user = await user_repo.get_or_create_user(
         telegram_id=message.from_user.id,
@@ -90,17 +99,14 @@ async def clear_handler(message: Message, database) -> None:
     # Clear conversation
     await message_repo.clear_conversation(user['id'])
     
-    await message.answer(
-        "🗑️ <b>Conversation cleared!</b>\n\n"
-        "I've deleted all our previous messages. "
-        "We can start a fresh conversation!"
-    )
+    await message.answer(_CLEAR_TEXT)
 
-async def stats_handler(message: Message, database) -> None:
+async def stats_handler(
+    message: Message,
+    user_repo: UserRepository,
+    message_repo: MessageRepository
+) -> None:
     """Handle /stats command."""
-    user_repo = UserRepository(database)
-    message_repo = MessageRepository(database)
-    
     # Get user
     user = await user_repo.get_or_create_user(
         telegram_id=message.from_user.id,
@@ -110,11 +116,13 @@ async def stats_handler(message: Message, database) -> None:
     # Get message count
     message_count = await message_repo.get_message_count(user['id'])
     
+    joined = datetime.fromtimestamp(user['created_at'], tz=timezone.utc)
+    
     stats_text = (
         "📊 <b>Your Statistics</b>\n\n"
         f"<b>User ID:</b> {user['id']}\n"
         f"<b>Username:</b> @{user['username'] or 'Not set'}\n"
-        f"<b>Joined:</b> {user['created_at']}\n"
+        f"<b>Joined:</b> {joined:%Y-%m-%d %H:%M:%S} UTC\n"
         f"<b>Total Messages:</b> {message_count}\n\n"
         "Keep chatting to increase your stats!"
     )
@@ -123,7 +131,8 @@ async def stats_handler(message: Message, database) -> None:
 
 async def message_handler(
     message: Message, 
-    database, 
+    user_repo: UserRepository,
+    message_repo: MessageRepository,
     ai_service: AIService,
     state: FSMContext
 ) -> None:
@@ -132,49 +141,40 @@ async def message_handler(
     if not message.text or message.text.strip() == "":
         return
     
-    user_repo = UserRepository(database)
-    message_repo = MessageRepository(database)
-    
-    # Get or create user
-    user = await user_repo.get_or_create_user(
+    # Only the internal ID is needed, which is cached after the first message
+    user_id = await user_repo.get_user_id(
         telegram_id=message.from_user.id,
         username=message.from_user.username
     )
     
-    # Save user message to database
-    await message_repo.create_message(
-        user_id=user['id'],
-        role='user',
-        content=message.text
-    )
-    
-    # Get conversation history
-    history = await message_repo.get_conversation_history(user['id'], limit=10)
-    
-    # Format history for AI
-    formatted_history = []
-    for msg in reversed(history):  # Oldest first
-        formatted_history.append({
-            "role": msg['role'],
-            "content": msg['content']
-        })
-    
-    # Send typing action
-    await message.bot.send_chat_action(
-        chat_id=message.chat.id,
-        action="typing"
+    # Fetch prior history, store the user message as soon as it arrives and
+    # show typing concurrently. History is queued first so it excludes the
+    # current message, which AIService appends itself. Storing the message
+    # now keeps it in the history of any follow-up sent before this reply
+    # lands, and keeps it even if the handler is cancelled on shutdown.
+    history, _, _ = await asyncio.gather(
+        message_repo.get_conversation_history(user_id, limit=10),
+        message_repo.create_message(
+            user_id=user_id,
+            role='user',
+            content=message.text
+        ),
+        message.bot.send_chat_action(
+            chat_id=message.chat.id,
+            action="typing"
+        )
     )
     
     try:
         # Get AI response
         ai_response = await ai_service.generate_response(
             message=message.text,
-            history=formatted_history
+            history=history
         )
         
         # Save AI response to database
         await message_repo.create_message(
-            user_id=user['id'],
+            user_id=user_id,
             role='assistant',
             content=ai_response
         )
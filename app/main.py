@@ -2,16 +2,19 @@
 Main application entry point with graceful shutdown handling.
 """
 import asyncio
+import os
 import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Optional, Set
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 from app.database.connection import Database
+from app.database.repository import UserRepository, MessageRepository
 from app.handlers.router import setup_routers
 from app.utils.logger import get_logger
 from config import config
@@ -21,20 +24,36 @@ logger = get_logger(__name__)
 class Application:
     """Main application class managing bot lifecycle."""
     
+    # Seconds between periodic PRAGMA optimize runs
+    OPTIMIZE_INTERVAL = 15 * 60
+    
+    # Seconds to wait on shutdown for updates still being handled; an AI
+    # call can take up to 30 seconds per fallback model
+    DRAIN_TIMEOUT = 120
+    
     def __init__(self):
         self.bot: Optional[Bot] = None
         self.dp: Optional[Dispatcher] = None
         self.database: Optional[Database] = None
+        self._optimize_task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
         self._shutdown_event = asyncio.Event()
         
     async def startup(self):
         """Initialize application components."""
         logger.info("Starting Telegram AI Bot...")
         
+        # Blocking g4f calls run in the default executor and mostly wait on
+        # I/O, so size it for concurrent users rather than CPU cores
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 8))
+        )
+        
         # Initialize database
         self.database = Database()
         await self.database.connect()
         logger.info("Database connected")
+        self._optimize_task = asyncio.create_task(self._pragma_optimize_loop())
         
         # Initialize bot with HTML parse mode
         self.bot = Bot(
@@ -49,12 +68,22 @@ class Application:
         from app.services.ai_service import AIService
         ai_service = AIService()
         
+        # Share one instance of each repository across updates; UserRepository
+        # holds the telegram_id cache, which only works if it is shared
+        user_repo = UserRepository(self.database)
+        message_repo = MessageRepository(self.database)
+        
         # Inject dependencies to dispatcher
         self.dp.workflow_data.update({
             'database': self.database,
+            'user_repo': user_repo,
+            'message_repo': message_repo,
             'ai_service': ai_service
         })
         
+        # Track running handlers so shutdown can wait for them
+        self.dp.update.outer_middleware(self._track_update)
+        
         # Setup routers
         setup_routers(self.dp)
         
@@ -72,6 +101,14 @@ class Application:
             await self.bot.session.close()
             logger.info("Bot session closed")
         
+        # Stop periodic database maintenance
+        if self._optimize_task:
+            self._optimize_task.cancel()
+            try:
+                await self._optimize_task
+            except asyncio.CancelledError:
+                pass
+        
         # Close database connection
         if self.database:
             await self.database.disconnect()
@@ -80,12 +117,55 @@ class Application:
         self._shutdown_event.set()
         logger.info("Application shutdown completed")
     
+    async def _track_update(self, handler, event, data):
+        """Outer middleware recording update handlers that are still running."""
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(task)
+    
+    async def _drain_updates(self):
+        """Wait for in-flight update handlers so their database writes finish."""
+        pending = self._in_flight - {asyncio.current_task()}
+        if not pending:
+            return
+        
+        logger.info(f"Waiting for {len(pending)} in-flight updates...")
+        _, pending = await asyncio.wait(pending, timeout=self.DRAIN_TIMEOUT)
+        if pending:
+            logger.warning(f"Cancelling {len(pending)} updates still running")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def _pragma_optimize_loop(self):
+        """Periodically refresh SQLite query planner statistics."""
+        while True:
+            await asyncio.sleep(self.OPTIMIZE_INTERVAL)
+            try:
+                await self.database.execute("PRAGMA optimize")
+                logger.debug("PRAGMA optimize completed")
+            except Exception as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
+    
     def _setup_signal_handlers(self):
         """Setup signal handlers for graceful shutdown."""
+        loop = asyncio.get_running_loop()
         for sig in (signal.SIGTERM, signal.SIGINT):
-            signal.signal(sig, self._signal_handler)
+            try:
+                loop.add_signal_handler(sig, self._signal_handler, sig)
+            except NotImplementedError:
+                # Event loops on Windows do not support add_signal_handler
+                signal.signal(
+                    sig,
+                    lambda signum, frame: loop.call_soon_threadsafe(
+                        self._signal_handler, signum
+                    )
+                )
     
-    def _signal_handler(self, signum, frame):
+    def _signal_handler(self, signum):
         """Handle shutdown signals."""
         logger.info(f"Received signal {signum}, initiating shutdown...")
         self._shutdown_event.set()
@@ -94,18 +174,32 @@ class Application:
         """Main application run loop."""
         await self.startup()
         
-        try:
-            # Start polling
-            logger.info("Starting bot polling...")
-            await self.dp.start_polling(
+        # Start polling and stop it as soon as a shutdown signal arrives
+        logger.info("Starting bot polling...")
+        polling = asyncio.create_task(
+            self.dp.start_polling(
                 self.bot,
                 handle_signals=False  # We handle signals manually
             )
+        )
+        shutdown_requested = asyncio.create_task(self._shutdown_event.wait())
+        
+        try:
+            done, _ = await asyncio.wait(
+                {polling, shutdown_requested},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if polling in done:
+                polling.result()
         except asyncio.CancelledError:
             logger.info("Polling cancelled")
         except Exception as e:
             logger.error(f"Polling error: {e}", exc_info=True)
         finally:
+            for task in (polling, shutdown_requested):
+                task.cancel()
+            await asyncio.gather(polling, shutdown_requested, return_exceptions=True)
+            await self._drain_updates()
             await self.shutdown()
 
 async def main():
@@ -5,7 +5,6 @@ import g4f
 from typing import List, Dict, Optional
 from dataclasses import dataclass
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
 from app.utils.logger import get_logger
 from config import config
@@ -27,7 +26,16 @@ class AIService:
         self.model = "gpt-3.5-turbo"  # Default model
         self.max_tokens = 2048
         self.temperature = 0.7
-        self._executor = ThreadPoolExecutor(max_workers=2)
+        
+        # System prompt is constant, so build it once and treat it as read-only
+        self._system_message = {
+            "role": "system",
+            "content": (
+                "You are a helpful AI assistant in a Telegram bot. "
+                "Be concise, friendly, and helpful. "
+                "Keep responses reasonably short for mobile users."
+            )
+        }
         
         # Available models (fallback order)
         self.available_models = [
@@ -54,20 +62,9 @@ class AIService:
             AI response as string
         """
         try:
-            # Prepare messages list
-            messages = []
-            
-            # Add system message
-            system_prompt = """You are a helpful AI assistant in a Telegram bot. 
-            Be concise, friendly, and helpful. 
-            Keep responses reasonably short for mobile users."""
-            messages.append({"role": "system", "content": system_prompt})
-            
-            # Add conversation history
-            if history:
-                messages.extend(history)
-            
-            # Add current message
+            # Prepare messages list: system prompt, history, current message
+            messages = [self._system_message]
+            messages.extend(history or ())
             messages.append({"role": "user", "content": message})
             
             # Generate response using g4f
@@ -76,7 +73,7 @@ class AIService:
             # Clean up response
             response = response.strip()
             
-            logger.debug(f"Generated response: {response[:100]}...")
+            logger.debug("Generated response: %.100s...", response)
             return response
             
         except Exception as e:
@@ -102,28 +99,25 @@ class AIService:
         # Try different models as fallback
         for model in self.available_models:
             try:
-                logger.debug(f"Trying model: {model}")
+                logger.debug("Trying model: %s", model)
                 
-                # Run g4f in thread pool to avoid blocking
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    self._executor,
-                    lambda: g4f.ChatCompletion.create(
-                        model=model,
-                        messages=messages,
-                        max_tokens=self.max_tokens,
-                        temperature=self.temperature,
-                        timeout=30  # 30 second timeout
-                    )
+                # Run g4f in the default thread pool to avoid blocking
+                response = await asyncio.to_thread(
+                    g4f.ChatCompletion.create,
+                    model=model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    timeout=30  # 30 second timeout
                 )
                 
                 if response and isinstance(response, str):
-                    logger.info(f"Successfully generated response using {model}")
+                    logger.info("Successfully generated response using %s", model)
                     return response
                 
             except Exception as e:
                 last_exception = e
-                logger.warning(f"Model {model} failed: {str(e)[:100]}")
+                logger.warning("Model %s failed: %.100s", model, e)
                 continue
         
         # If all models failed
@@ -148,5 +142,4 @@ class AIService:
     
     async def cleanup(self):
         """Cleanup resources."""
-        self._executor.shutdown(wait=False)
         logger.info("AI Service cleanup completed")
\ No newline at end of file
@@ -26,16 +26,20 @@ class CustomFormatter(logging.Formatter):
         fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         super().__init__(fmt, datefmt='%Y-%m-%d %H:%M:%S')
         self.use_color = use_color
+        
+        # Precompute (prefix, suffix) per level so format() is a single lookup
+        reset = self.COLORS['RESET']
+        self._wrap = {
+            level: (color, reset)
+            for level, color in self.COLORS.items()
+            if use_color and level != 'RESET'
+        }
+        self._base_format = super().format
     
     def format(self, record):
         """Format log record with optional colors."""
-        formatted = super().format(record)
-        
-        if self.use_color and record.levelname in self.COLORS:
-            formatted = (f"{self.COLORS[record.levelname]}{formatted}"
-                        f"{self.COLORS['RESET']}")
-        
-        return formatted
+        prefix, suffix = self._wrap.get(record.levelname, ('', ''))
+        return f"{prefix}{self._base_format(record)}{suffix}"
 
 def setup_logging(
     log_level: str = "INFO",
@@ -52,6 +56,12 @@ def setup_logging(
         max_size_mb: Maximum log file size in MB
         backup_count: Number of backup files to keep
     """
+    # Skip per-record thread/process lookups and don't print tracebacks
+    # for errors raised while emitting records
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.raiseExceptions = False
+    
     # Convert string level to logging constant
     level = getattr(logging, log_level.upper(), logging.INFO)
     
@@ -6,7 +6,16 @@ import asyncio
 import sys
 from app.main import main
 
+try:
+    # uvloop is optional (not available on Windows); fall back to asyncio
+    import uvloop
+except ImportError:
+    uvloop = None
+
 if __name__ == "__main__":
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt: